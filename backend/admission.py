@@ -0,0 +1,311 @@
+import os
+import re
+import math
+import asyncio
+import time
+import threading
+import itertools
+from collections import deque
+
+from metrics import inc, observe
+
+# --- PER-MODEL RATE LIMITS (Groq quotas per minute) ---
+RATE_LIMITS = {
+    "llama-3.1-8b-instant": {"rpm": 30, "tpm": 6000},
+    "llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12000},
+    "llama-3.1-70b-versatile": {"rpm": 30, "tpm": 6000},
+    "llama-3.2-90b-vision-preview": {"rpm": 15, "tpm": 7000},
+    "llama-3.2-11b-vision-preview": {"rpm": 30, "tpm": 7000},
+}
+DEFAULT_RATE_LIMITS = {"rpm": 30, "tpm": 6000}
+
+MAX_QUEUE = int(os.getenv("SYNAPSE_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT = float(os.getenv("SYNAPSE_QUEUE_TIMEOUT", "30"))
+
+
+# --- TOKEN BUCKET ---
+class TokenBucket:
+    """Refills continuously up to `per_minute`; can be pinned empty until a server-reported reset."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.level
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` can be taken (0 if it can be taken now, inf if it never can)."""
+        if amount > self.capacity:
+            return math.inf
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.level < amount:
+            wait = max(wait, (amount - self.level) / self.rate)
+        return wait
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, remaining, reset_seconds, now):
+        """Trusts the server when it reports less headroom than we think we have."""
+        self._refill(now)
+        if remaining is not None and remaining < self.level:
+            self.level = float(remaining)
+        if remaining == 0 and reset_seconds:
+            self.blocked_until = max(self.blocked_until, now + reset_seconds)
+
+
+def parse_reset(value):
+    """Parses Groq reset values such as '7.66s', '2m59.56s', '1h2m' or '120ms' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"h": 3600, "m": 60, "s": 1, "ms": 0.001}[unit]
+    return total
+
+
+# --- SCHEDULER ---
+class QueueFull(Exception):
+    def __init__(self, depth, retry_after):
+        super().__init__(f"Admission queue is full ({depth} waiting)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class Ticket:
+    _ids = itertools.count()
+
+    def __init__(self, fast, reservations):
+        self.id = next(self._ids)
+        self.lane = "fast" if fast else "normal"
+        self.models = list(reservations)
+        self.tokens = dict(reservations)  # Tokens to reserve on each model, which can differ per quota
+        self.position = 0     # Earlier tickets competing for the same models when this one was queued
+        self.enqueued_at = time.monotonic()
+        self.event = None     # Set by acquire_async so admissions elsewhere can wake the event loop
+        self.loop = None
+
+
+class AdmissionScheduler:
+    """
+    Admits model calls against per-model request and token buckets.
+    Waiting requests sit in a bounded queue with two lanes. Ordering is FIFO per
+    model: a ticket only waits behind earlier tickets that could use one of the same
+    models, and fast-lane tickets go ahead of normal ones on any model they share.
+    A vision request stuck on its quota therefore doesn't hold up text requests.
+    """
+    def __init__(self, max_queue=MAX_QUEUE, timeout=QUEUE_TIMEOUT):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._lanes = {"fast": deque(), "normal": deque()}
+        self._buckets = {}
+
+    def _bucket(self, model_id):
+        if model_id not in self._buckets:
+            limits = RATE_LIMITS.get(model_id, DEFAULT_RATE_LIMITS)
+            self._buckets[model_id] = {"requests": TokenBucket(limits["rpm"]), "tokens": TokenBucket(limits["tpm"])}
+        return self._buckets[model_id]
+
+    def _depth(self):
+        return len(self._lanes["fast"]) + len(self._lanes["normal"])
+
+    def _retry_after(self):
+        total_rpm = sum(RATE_LIMITS.get(m, DEFAULT_RATE_LIMITS)["rpm"] for m in self._buckets) or DEFAULT_RATE_LIMITS["rpm"]
+        return max(1, math.ceil(self._depth() * 60 / total_rpm))
+
+    def _notify(self):
+        """Wakes blocking waiters and any tickets parked on an event loop."""
+        self._cond.notify_all()
+        for lane in self._lanes.values():
+            for ticket in lane:
+                if ticket.loop is not None:
+                    ticket.loop.call_soon_threadsafe(ticket.event.set)
+
+    # --- Queue ---
+    def _ahead(self, ticket, model_id=None):
+        """Earlier tickets that get first pick of `model_id` (or of any of the ticket's models)."""
+        wanted = {model_id} if model_id else set(ticket.models)
+        lanes = [self._lanes["fast"]] + ([self._lanes["normal"]] if ticket.lane == "normal" else [])
+        ahead = []
+        for lane in lanes:
+            for other in lane:
+                if other is ticket:
+                    break
+                if wanted.intersection(other.models):
+                    ahead.append(other)
+        return ahead
+
+    def fits(self, reservations):
+        """False when no model's per-minute quota can hold its reservation, so waiting can't help."""
+        with self._cond:
+            return any(tokens <= self._bucket(m)["tokens"].capacity for m, tokens in reservations.items())
+
+    def enqueue(self, fast, reservations):
+        """
+        Queues a request that can run on any model in `reservations` (model -> tokens, in
+        preference order); raises QueueFull instead of queueing one that could only time out.
+        """
+        with self._cond:
+            if self._depth() >= self.max_queue:
+                inc("synapse_admission_rejected_total", help_text="Requests refused because the queue was full.")
+                raise QueueFull(self._depth(), self._retry_after())
+            ticket = Ticket(fast, reservations)
+            self._lanes[ticket.lane].append(ticket)
+            ticket.position = len(self._ahead(ticket))
+            return ticket
+
+    def cancel(self, ticket):
+        with self._cond:
+            lane = self._lanes[ticket.lane]
+            if ticket in lane:
+                lane.remove(ticket)
+                self._notify()
+
+    # --- Admission ---
+    def _try_admit(self, ticket):
+        """Takes capacity on the first model nobody earlier is waiting for, else returns how long until one frees up."""
+        now, soonest = time.monotonic(), math.inf
+        for model_id in ticket.models:
+            if self._ahead(ticket, model_id):
+                continue
+            bucket = self._bucket(model_id)
+            tokens = ticket.tokens[model_id]
+            wait = max(bucket["requests"].wait_time(1, now), bucket["tokens"].wait_time(tokens, now))
+            if wait == 0:
+                bucket["requests"].take(1)
+                bucket["tokens"].take(tokens)
+                self._lanes[ticket.lane].remove(ticket)
+                self._notify()
+                observe("synapse_queue_wait_seconds", now - ticket.enqueued_at,
+                        "Time spent waiting for admission.", lane=ticket.lane)
+                return model_id, 0
+            soonest = min(soonest, wait)
+        return None, soonest
+
+    def _time_out(self, ticket):
+        self._lanes[ticket.lane].remove(ticket)
+        self._notify()
+        inc("synapse_admission_timeouts_total", help_text="Requests that timed out waiting for admission.", lane=ticket.lane)
+
+    def acquire(self, ticket):
+        """Blocks until one of the ticket's models has room; returns the model or None on timeout."""
+        deadline = ticket.enqueued_at + self.timeout
+        with self._cond:
+            while True:
+                model_id, wait = self._try_admit(ticket)
+                if model_id:
+                    return model_id
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._time_out(ticket)
+                    return None
+                # Buckets refill with time, so wake up when the soonest one should have room
+                self._cond.wait(min(remaining, wait))
+
+    async def acquire_async(self, ticket):
+        """Same as acquire, but waits on the event loop instead of holding a worker thread."""
+        deadline = ticket.enqueued_at + self.timeout
+        ticket.loop, ticket.event = asyncio.get_running_loop(), asyncio.Event()
+        try:
+            while True:
+                with self._cond:
+                    # Cleared under the lock, so a release after this check still wakes us
+                    ticket.event.clear()
+                    model_id, wait = self._try_admit(ticket)
+                    if model_id:
+                        return model_id
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._time_out(ticket)
+                        return None
+                try:
+                    await asyncio.wait_for(ticket.event.wait(), min(remaining, wait))
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # Client went away while queued
+            self.cancel(ticket)
+            raise
+
+    def try_take(self, model_id, tokens):
+        """Non-blocking admission for fallback models after the admitted one failed."""
+        with self._cond:
+            bucket = self._bucket(model_id)
+            now = time.monotonic()
+            if bucket["requests"].wait_time(1, now) or bucket["tokens"].wait_time(tokens, now):
+                return False
+            bucket["requests"].take(1)
+            bucket["tokens"].take(tokens)
+            return True
+
+    def release(self, model_id, unused_tokens):
+        """Returns the part of a token reservation the reply didn't use."""
+        if unused_tokens <= 0:
+            return
+        with self._cond:
+            self._bucket(model_id)["tokens"].give_back(unused_tokens)
+            self._notify()
+
+    def update_from_headers(self, model_id, headers):
+        """Syncs buckets with Groq's x-ratelimit-* (and retry-after) response headers."""
+        if not headers:
+            return
+        def number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+        with self._cond:
+            now = time.monotonic()
+            bucket = self._bucket(model_id)
+            retry_after = parse_reset(headers.get("retry-after"))
+            bucket["tokens"].sync(number("x-ratelimit-remaining-tokens"),
+                                  parse_reset(headers.get("x-ratelimit-reset-tokens")) or retry_after, now)
+            # Groq's *-requests headers count the per-day quota, so they can't top up the per-minute
+            # bucket; an exhausted daily quota only blocks the model until it resets
+            if number("x-ratelimit-remaining-requests") == 0:
+                reset = parse_reset(headers.get("x-ratelimit-reset-requests")) or retry_after
+                if reset:
+                    bucket["requests"].blocked_until = max(bucket["requests"].blocked_until, now + reset)
+            if retry_after:
+                bucket["requests"].blocked_until = max(bucket["requests"].blocked_until, now + retry_after)
+            self._notify()
+
+    def status(self):
+        with self._cond:
+            now = time.monotonic()
+            models = {}
+            for model_id, bucket in self._buckets.items():
+                blocked_until = max(bucket["requests"].blocked_until, bucket["tokens"].blocked_until)
+                models[model_id] = {
+                    "requests_left": int(bucket["requests"].available(now)),
+                    "tokens_left": int(bucket["tokens"].available(now)),
+                    "blocked_for_s": round(max(blocked_until - now, 0), 1),
+                }
+            return {
+                "fast_waiting": len(self._lanes["fast"]),
+                "normal_waiting": len(self._lanes["normal"]),
+                "max_queue": self.max_queue,
+                "retry_after": self._retry_after(),
+                "models": models,
+            }
+
+
+scheduler = AdmissionScheduler()
@@ -0,0 +1,409 @@
+"""
+Offline benchmark for the Synapse-V backend.
+
+Swaps the Groq client (and gTTS) for local fakes, drives the API in-process
+at a fixed concurrency and times the document extractors over a generated
+corpus. Results are written as JSON so two commits can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import os
+import io
+import sys
+import csv
+import json
+import time
+import wave
+import math
+import random
+import shutil
+import asyncio
+import zipfile
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import subprocess
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+import engine
+import main
+import admission
+
+
+# --- FAKE BACKENDS ---
+class FakeStream:
+    """Yields chat chunks shaped like Groq's, after a first-token delay and at a fixed token rate."""
+    def __init__(self, n_tokens, first_token_delay, token_rate):
+        self.n_tokens = n_tokens
+        self.first_token_delay = first_token_delay
+        self.token_rate = token_rate
+
+    def __iter__(self):
+        time.sleep(self.first_token_delay)
+        for i in range(self.n_tokens):
+            if i and self.token_rate:
+                time.sleep(1 / self.token_rate)
+            delta = SimpleNamespace(content=f"tok{i} ")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class FakeGroq:
+    def __init__(self, n_tokens=200, first_token_delay=0.3, token_rate=500, transcribe_delay=0.2):
+        raw = SimpleNamespace(create=self._create_raw)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create, with_raw_response=raw))
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._transcribe))
+        self.n_tokens = n_tokens
+        self.first_token_delay = first_token_delay
+        self.token_rate = token_rate
+        self.transcribe_delay = transcribe_delay
+
+    def _create(self, model, messages, stream=False, **kwargs):
+        return FakeStream(self.n_tokens, self.first_token_delay, self.token_rate)
+
+    def _create_raw(self, model, messages, stream=False, **kwargs):
+        stream_obj = self._create(model, messages, stream, **kwargs)
+        return SimpleNamespace(headers={}, parse=lambda: stream_obj)
+
+    def _transcribe(self, file, model, language=None, response_format="text"):
+        time.sleep(self.transcribe_delay)
+        return "namaste, aaj ka mausam kaisa hai?"
+
+
+class FakeTTS:
+    def __init__(self, text, lang="en"):
+        self.text = text
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(b"\xff\xfb" + bytes(2048))
+
+
+# --- CORPUS ---
+def _write_pdf(path, lines):
+    """Minimal single-font PDF with one text line per row, readable by PyPDF2."""
+    stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({l}) '" for l in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = io.BytesIO(), []
+    out.write(b"%PDF-1.4\n")
+    for i, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for off in offsets:
+        out.write(f"{off:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+
+
+def _sentences(rng, n):
+    words = ["metro", "upi", "recharge", "biryani", "office", "train", "invoice", "report", "delhi", "mumbai"]
+    return [" ".join(rng.choice(words) for _ in range(12)) for _ in range(n)]
+
+
+def build_corpus(corpus_dir, rows=5000, seed=7):
+    """Generates one file per supported type (plus archives of them) and returns their paths."""
+    import docx
+    import pandas as pd
+    import py7zr
+
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = {}
+
+    paths[".txt"] = os.path.join(corpus_dir, "notes.txt")
+    with open(paths[".txt"], "w") as f:
+        f.write("\n".join(_sentences(rng, rows // 10)))
+
+    paths[".pdf"] = os.path.join(corpus_dir, "report.pdf")
+    _write_pdf(paths[".pdf"], _sentences(rng, 60))
+
+    paths[".docx"] = os.path.join(corpus_dir, "letter.docx")
+    document = docx.Document()
+    for s in _sentences(rng, rows // 20):
+        document.add_paragraph(s)
+    document.save(paths[".docx"])
+
+    table = {
+        "city": [rng.choice(["Mumbai", "Pune", "Delhi", "Chennai"]) for _ in range(rows)],
+        "amount": [round(rng.uniform(10, 5000), 2) for _ in range(rows)],
+        "items": [rng.randint(1, 20) for _ in range(rows)],
+    }
+    paths[".csv"] = os.path.join(corpus_dir, "orders.csv")
+    with open(paths[".csv"], "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(table.keys())
+        writer.writerows(zip(*table.values()))
+
+    paths[".xlsx"] = os.path.join(corpus_dir, "orders.xlsx")
+    pd.DataFrame(table).to_excel(paths[".xlsx"], index=False)
+
+    members = [paths[e] for e in (".txt", ".pdf", ".docx", ".csv")]
+    paths[".zip"] = os.path.join(corpus_dir, "bundle.zip")
+    with zipfile.ZipFile(paths[".zip"], "w", zipfile.ZIP_DEFLATED) as z:
+        for p in members:
+            z.write(p, os.path.basename(p))
+    paths[".7z"] = os.path.join(corpus_dir, "bundle.7z")
+    with py7zr.SevenZipFile(paths[".7z"], "w") as z:
+        for p in members:
+            z.write(p, os.path.basename(p))
+    return paths
+
+
+def make_wav(seconds=3, rate=16000, seed=7):
+    rng = random.Random(seed)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        frames = bytearray()
+        for i in range(seconds * rate):
+            sample = int(8000 * math.sin(2 * math.pi * 220 * i / rate) + rng.randint(-600, 600))
+            frames += sample.to_bytes(2, "little", signed=True)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+# --- STATS ---
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def peak_rss_mb():
+    # ru_maxrss is a process-wide high-water mark (KB on Linux, bytes on macOS);
+    # each scenario runs in its own process so this is that scenario's peak
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(latencies, wall, errors, extra=None):
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    result.update(extra or {})
+    return result
+
+
+# --- HTTP SCENARIOS ---
+async def _drive(make_request, n_requests, concurrency):
+    """Runs make_request(client) n_requests times with at most `concurrency` in flight."""
+    latencies, ttfbs, errors = [], [], 0
+    sem = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one():
+            nonlocal errors
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    ttfb = await make_request(client)
+                    latencies.append(time.perf_counter() - start)
+                    if ttfb is not None:
+                        ttfbs.append(ttfb - start)
+                except Exception as e:
+                    errors += 1
+                    print(f"Request failed: {e}")
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n_requests)))
+        wall = time.perf_counter() - wall_start
+
+    extra = {}
+    if ttfbs:
+        extra = {"ttfb_p50_ms": round(percentile(ttfbs, 50) * 1000, 2),
+                 "ttfb_p95_ms": round(percentile(ttfbs, 95) * 1000, 2)}
+    return summarize(latencies, wall, errors, extra)
+
+
+def stream_request(doc_paths=(), fast=False):
+    uploads = []
+    for path in doc_paths:
+        with open(path, "rb") as f:
+            uploads.append(("documents", (os.path.basename(path), f.read())))
+
+    async def make_request(client):
+        data = {"text": "Summarise this for me", "lang": "en", "history": "[]", "fast": str(fast).lower()}
+        files = uploads or None
+        ttfb = None
+        async with client.stream("POST", "/stream_process", data=data, files=files) as response:
+            response.raise_for_status()
+            async for _ in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter()
+        return ttfb
+    return make_request
+
+
+def voice_request(wav_bytes, noise=False):
+    async def make_request(client):
+        response = await client.post(
+            "/process_voice",
+            data={"lang": "en", "noise": str(noise).lower()},
+            files={"audio": ("in.wav", wav_bytes, "audio/wav")},
+        )
+        response.raise_for_status()
+    return make_request
+
+
+def audio_request():
+    async def make_request(client):
+        response = await client.post("/get_audio", data={"text": "Namaste! " * 20, "lang": "en", "voice": "Default"})
+        response.raise_for_status()
+        if "audio_url" not in response.json():
+            raise RuntimeError(response.json())
+    return make_request
+
+
+# --- EXTRACTOR SCENARIO ---
+def bench_extractors(corpus, repeats):
+    results = {}
+    for ext, path in corpus.items():
+        latencies, errors = [], 0
+        wall_start = time.perf_counter()
+        for _ in range(repeats):
+            start = time.perf_counter()
+            text = engine.get_document_context(path)
+            latencies.append(time.perf_counter() - start)
+            if "Error" in text[:200]:
+                errors += 1
+        wall = time.perf_counter() - wall_start
+        results[ext] = summarize(latencies, wall, errors, {"chars": len(text), "bytes": os.path.getsize(path)})
+    return results
+
+
+# --- COMPARISON ---
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nComparison vs {baseline.get('commit', baseline_path)}:", file=sys.stderr)
+    for name, stats in current["scenarios"].items():
+        rows = stats if name == "extractors" else {name: stats}
+        base_rows = baseline["scenarios"].get(name, {})
+        base_rows = base_rows if name == "extractors" else {name: base_rows}
+        for row, s in rows.items():
+            b = base_rows.get(row, {})
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_rss_mb"):
+                if s.get(metric) is not None and b.get(metric):
+                    delta = (s[metric] - b[metric]) / b[metric] * 100
+                    print(f"  {row:<22} {metric:<15} {b[metric]:>10} -> {s[metric]:>10} ({delta:+.1f}%)", file=sys.stderr)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+HTTP_SCENARIOS = {
+    "stream": lambda args, corpus: stream_request(),
+    "stream_fast": lambda args, corpus: stream_request(fast=True),
+    "stream_doc": lambda args, corpus: stream_request(doc_paths=[corpus[".pdf"]]),
+    "stream_multi_doc": lambda args, corpus: stream_request(doc_paths=[corpus[e] for e in (".pdf", ".docx", ".csv", ".zip")]),
+    "voice": lambda args, corpus: voice_request(make_wav(), noise=args["noise"]),
+    "audio": lambda args, corpus: audio_request(),
+}
+
+
+def install_fakes(args, work_dir):
+    engine.client = FakeGroq(args["tokens"], args["first_token_delay"], args["token_rate"], args["transcribe_delay"])
+    if not args["real_rate_limits"]:
+        # The fake backend has no quota, so measure the pipeline rather than the scheduler's pacing
+        unlimited = {"rpm": 10**9, "tpm": 10**12}
+        admission.DEFAULT_RATE_LIMITS = unlimited
+        admission.RATE_LIMITS = {}
+        admission.scheduler = admission.AdmissionScheduler(max_queue=10**6)
+        engine.scheduler = admission.scheduler
+        main.scheduler = admission.scheduler
+    # gTTS is imported lazily, so a stub module stands in for it
+    sys.modules["gtts"] = SimpleNamespace(gTTS=FakeTTS)
+    main.UPLOAD_DIR = tempfile.mkdtemp(prefix="uploads_", dir=work_dir)
+
+
+def run_scenario(name, args, corpus, work_dir):
+    """Runs one scenario; called in its own process by main_cli."""
+    install_fakes(args, work_dir)
+    if name == "extractors":
+        return bench_extractors(corpus, args["extract_repeats"])
+    return asyncio.run(_drive(HTTP_SCENARIOS[name](args, corpus), args["requests"], args["concurrency"]))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline Synapse-V backend benchmark")
+    parser.add_argument("--scenarios", default="stream,stream_doc,voice,audio,extractors")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="Fake Groq seconds before first token")
+    parser.add_argument("--token-rate", type=float, default=500, help="Fake Groq tokens per second")
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens per fake completion")
+    parser.add_argument("--transcribe-delay", type=float, default=0.2)
+    parser.add_argument("--rows", type=int, default=5000, help="Rows in generated CSV/XLSX")
+    parser.add_argument("--extract-repeats", type=int, default=5)
+    parser.add_argument("--noise", action="store_true", help="Run denoise in /process_voice")
+    parser.add_argument("--real-rate-limits", action="store_true", help="Keep Groq per-minute quotas in the admission scheduler")
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="Baseline JSON from a previous run")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(",")
+    unknown = [n for n in scenarios if n not in HTTP_SCENARIOS and n != "extractors"]
+    if unknown:
+        parser.error(f"Unknown scenario: {', '.join(unknown)}")
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "scenarios": {},
+    }
+    work_dir = tempfile.mkdtemp(prefix="synapse_bench_")
+    try:
+        corpus = build_corpus(os.path.join(work_dir, "corpus"), rows=args.rows) \
+            if {"stream_doc", "stream_multi_doc", "extractors"} & set(scenarios) else {}
+        # A fresh process per scenario, so peak RSS and warm caches don't leak between scenarios
+        spawn = multiprocessing.get_context("spawn")
+        for name in scenarios:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                results["scenarios"][name] = pool.submit(run_scenario, name, vars(args), corpus, work_dir).result()
+            print(f"{name}: done", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,158 @@
+import re
+from functools import lru_cache
+
+from admission import RATE_LIMITS, DEFAULT_RATE_LIMITS
+
+# --- PER-MODEL LIMITS ---
+# context: model context window, output: tokens reserved for the reply,
+# input_cap: most prompt tokens we are willing to spend on that model.
+# Prompt plus output must also fit the model's tokens-per-minute quota (admission.RATE_LIMITS),
+# otherwise the request could never be admitted.
+MODEL_LIMITS = {
+    "llama-3.1-8b-instant": {"context": 131072, "output": 1024, "input_cap": 4000},
+    "llama-3.3-70b-versatile": {"context": 131072, "output": 2048, "input_cap": 16000},
+    "llama-3.1-70b-versatile": {"context": 131072, "output": 2048, "input_cap": 16000},
+    "llama-3.2-90b-vision-preview": {"context": 8192, "output": 1024, "input_cap": 6000},
+    "llama-3.2-11b-vision-preview": {"context": 8192, "output": 1024, "input_cap": 6000},
+}
+DEFAULT_LIMITS = {"context": 8192, "output": 1024, "input_cap": 4000}
+
+IMAGE_TOKENS = 1600      # Rough cost of one attached image on the vision models
+MIN_TEXT_TOKENS = 1000   # Kept free of images for system prompt, question and some context
+MESSAGE_OVERHEAD = 4     # Role/format tokens added per chat message
+TRUNCATION_MARKER = "\n... [Content Truncated] ..."
+CACHE_MAX_CHARS = 16384  # Larger blocks are not worth pinning in the estimate cache
+
+# Preferred cut points, best first: paragraph, line, sentence (English/Hindi), word
+_BOUNDARIES = [re.compile(r"\n\s*\n"), re.compile(r"\n"), re.compile(r"[.!?।]\s"), re.compile(r"\s")]
+
+
+# --- TOKEN ESTIMATION ---
+def _estimate(text):
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return int(ascii_chars / 4 + other_chars / 1.5) + 1
+
+
+_estimate_cached = lru_cache(maxsize=4096)(_estimate)
+
+
+def estimate_tokens(text):
+    """Cheap token estimate: ~4 ASCII chars per token, Devanagari and other scripts far denser."""
+    # Cache history turns and prompt blocks; huge documents are estimated once and not kept alive
+    if text and len(text) > CACHE_MAX_CHARS:
+        return _estimate(text)
+    return _estimate_cached(text)
+
+
+def message_tokens(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        total = 0
+        for part in content:
+            if part.get("type") == "text":
+                total += estimate_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                total += IMAGE_TOKENS
+        return total + MESSAGE_OVERHEAD
+    return estimate_tokens(content or "") + MESSAGE_OVERHEAD
+
+
+def get_limits(model_id):
+    return MODEL_LIMITS.get(model_id, DEFAULT_LIMITS)
+
+
+def get_prompt_budget(models):
+    """Input-token budget that is safe for every model in `models`; pass one model to size a prompt for it."""
+    budgets = []
+    for model_id in models:
+        limits = get_limits(model_id)
+        tpm = RATE_LIMITS.get(model_id, DEFAULT_RATE_LIMITS)["tpm"]
+        budgets.append(min(limits["input_cap"], limits["context"] - limits["output"], tpm - limits["output"]))
+    return min(budgets) if budgets else DEFAULT_LIMITS["input_cap"]
+
+
+def max_images(models):
+    """How many images fit in the prompt budget while leaving MIN_TEXT_TOKENS for text."""
+    return max((get_prompt_budget(models) - MIN_TEXT_TOKENS) // IMAGE_TOKENS, 0)
+
+
+# --- TRUNCATION ---
+def truncate_to_tokens(text, max_tokens, marker=TRUNCATION_MARKER):
+    """Trims text to fit max_tokens, cutting at the nearest paragraph/line/sentence/word break."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max_tokens - estimate_tokens(marker)
+    if limit <= 0:
+        # Nothing fits, but say so rather than dropping the block silently
+        return marker if text else ""
+
+    # Longest prefix that fits, then back off to a natural break
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if _estimate(text[:mid]) <= limit:
+            lo = mid
+        else:
+            hi = mid - 1
+    head = text[:lo]
+    # Only accept a boundary in the last fifth of the window, otherwise try a finer one
+    for pattern in _BOUNDARIES:
+        matches = [m.start() for m in pattern.finditer(head, lo - lo // 5)]
+        if matches:
+            head = head[:matches[-1] + 1]
+            break
+    return head.rstrip() + marker
+
+
+def fit_history(chat_history, max_tokens):
+    """Keeps the most recent turns that fit inside max_tokens."""
+    kept, used = [], 0
+    for message in reversed(chat_history):
+        cost = message_tokens(message)
+        if used + cost > max_tokens:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def pack_documents(blocks, max_tokens):
+    """
+    Fits several document blocks into max_tokens, keeping their order.
+    Small blocks are kept whole; large ones split whatever is left evenly.
+    """
+    sizes = [estimate_tokens(b) for b in blocks]
+    shares, remaining = [0] * len(blocks), max_tokens
+    for n, i in enumerate(sorted(range(len(blocks)), key=lambda i: sizes[i])):
+        shares[i] = min(sizes[i], remaining // (len(blocks) - n))
+        remaining -= shares[i]
+    return "".join(truncate_to_tokens(b, share) for b, share in zip(blocks, shares))
+
+
+# --- BUDGET SPLIT ---
+def allocate_context(models, system_prompt, chat_history, doc_context, user_text, image_count=0, history_share=0.3):
+    """
+    Splits the prompt budget across system prompt, history and document context.
+    History is guaranteed `history_share` of what is left; either side can use the
+    other's unused share. doc_context may be one string or a list of per-file
+    blocks, which then share the document budget (see pack_documents).
+    Returns (chat_history, doc_context) trimmed to fit.
+    """
+    available = get_prompt_budget(models)
+    available -= estimate_tokens(system_prompt) + MESSAGE_OVERHEAD
+    available -= estimate_tokens(user_text) + MESSAGE_OVERHEAD
+    available -= IMAGE_TOKENS * image_count
+    available = max(available, 0)
+
+    history_tokens = sum(message_tokens(m) for m in chat_history)
+    blocks = [doc_context] if isinstance(doc_context, str) else list(doc_context)
+    doc_tokens = sum(estimate_tokens(b) for b in blocks)
+
+    history_budget = min(history_tokens, max(int(available * history_share), available - doc_tokens))
+    doc_budget = available - history_budget
+
+    return fit_history(chat_history, history_budget), pack_documents(blocks, doc_budget)
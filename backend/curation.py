@@ -0,0 +1,379 @@
+"""
+Offline curation pipeline for Hinglish prompt examples and evaluation sets.
+
+Reads local JSONL (optionally .gz) or Parquet shards in parallel worker
+processes, keeps rows whose text mentions any keyword, drops duplicates by
+normalized-text hash and writes Parquet parts as it goes. Work is split
+below the shard: one unit per Parquet row group and per byte range of a plain
+JSONL file (gzip can't be seeked, so a .gz shard is one unit). A part is
+flushed every few batches and the checkpoint records which units it covers,
+so an interrupted run only redoes the units since the last flush.
+
+Download the shards once (e.g. `huggingface-cli download
+Abhishekcr448/Hinglish-Everyday-Conversations-1M --repo-type dataset
+--local-dir data/hinglish`), then:
+
+    python curation.py data/hinglish --output curated/ --keywords keywords.txt
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import glob
+import time
+import hashlib
+import argparse
+import unicodedata
+from multiprocessing import Pool
+
+try:
+    import ahocorasick  # pip install pyahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Keywords that define "Everyday India" (shared with research_data.py)
+INDIAN_KEYWORDS = ["biryani", "metro", "upi", "diwali", "recharge", "aadhaar", "auto", "train", "office", "recipe"]
+
+SHARD_PATTERNS = ("*.jsonl", "*.jsonl.gz", "*.parquet")
+BATCH_ROWS = 50000
+UNIT_MB = 64          # Byte range per JSONL work unit
+FLUSH_BATCHES = 20    # Write a part and checkpoint after this many batches' worth of rows
+
+
+# --- KEYWORD MATCHING ---
+class KeywordMatcher:
+    """
+    Returns every keyword found in the text. Matches substrings by default (the
+    original research_data.py behaviour); whole_word=True requires non-word
+    characters or the text edge on both sides, so 'auto' no longer hits 'automatic'.
+    With pyahocorasick installed all keywords are found in one pass; the fallback
+    checks each keyword in turn and returns exactly the same set.
+    """
+    def __init__(self, keywords, whole_word=False):
+        self.keywords = sorted({k.strip().lower() for k in keywords if k.strip()})
+        if not self.keywords:
+            raise ValueError("No keywords given")
+        self.whole_word = whole_word
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+            self.find = self._find_aho
+        elif whole_word:
+            self._patterns = [(k, re.compile(rf"(?<!\w){re.escape(k)}(?!\w)")) for k in self.keywords]
+            self.find = self._find_regex
+        else:
+            self.find = self._find_substring
+
+    def _find_aho(self, text):
+        hits = set()
+        for end, keyword in self._automaton.iter(text):
+            start = end - len(keyword) + 1
+            if not self.whole_word or (not _is_word_char(text, start - 1) and not _is_word_char(text, end + 1)):
+                hits.add(keyword)
+        return hits
+
+    def _find_regex(self, text):
+        return {k for k, pattern in self._patterns if pattern.search(text)}
+
+    def _find_substring(self, text):
+        return {k for k in self.keywords if k in text}
+
+
+def _is_word_char(text, i):
+    """Same notion of a word character as regex \\w, so both matchers agree on boundaries."""
+    return 0 <= i < len(text) and (text[i].isalnum() or text[i] == "_")
+
+
+def normalize(text):
+    """Case-, width- and whitespace-insensitive form used for duplicate detection."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"[^\w\s]", "", text)
+    return " ".join(text.split())
+
+
+def text_hash(text):
+    return hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=12).hexdigest()
+
+
+# --- WORK UNITS ---
+def plan_units(path, unit_bytes):
+    """
+    Splits a shard into independently readable units (path, kind, start, end):
+    Parquet row groups, byte ranges of plain JSONL, or the whole file for .gz.
+    Returns (unit, size in bytes) pairs so the biggest units can be started first.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        meta = pq.ParquetFile(path).metadata
+        return [((path, "row_group", i, None), meta.row_group(i).total_byte_size) for i in range(meta.num_row_groups)]
+    size = os.path.getsize(path)
+    if path.endswith(".gz"):
+        return [((path, "file", None, None), size)]
+    return [((path, "bytes", start, min(start + unit_bytes, size)), min(unit_bytes, size - start))
+            for start in range(0, size, unit_bytes)]
+
+
+def unit_label(unit):
+    """Where in its shard a unit sits, e.g. 'row_group=3' or 'bytes=0-67108864'."""
+    path, kind, start, end = unit
+    if kind == "row_group":
+        return f"row_group={start}"
+    if kind == "bytes":
+        return f"bytes={start}-{end}"
+    return "file"
+
+
+def unit_key(unit):
+    """Checkpoint key; a whole-file unit is keyed by its path alone."""
+    return unit[0] if unit[1] == "file" else f"{unit[0]}#{unit_label(unit)}"
+
+
+def _read_range(path, start, end):
+    """Lines that start inside [start, end); the line crossing `start` belongs to the previous range."""
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+
+def _read_gzip(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        yield from f
+
+
+# --- SHARD READING ---
+def iter_batches(unit, fields, batch_rows=BATCH_ROWS):
+    """Yields lists of row dicts (only `fields`) without loading the whole unit."""
+    path, kind, start, end = unit
+    if kind == "row_group":
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        columns = [f for f in fields if f in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=batch_rows, row_groups=[start], columns=columns):
+            yield batch.to_pylist()
+        return
+
+    batch = []
+    lines = _read_range(path, start, end) if kind == "bytes" else _read_gzip(path)
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+        batch.append({k: row.get(k) for k in fields})
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- WORKER ---
+_matcher = None
+_config = None
+
+
+def _init_worker(keywords, config):
+    global _matcher, _config
+    _matcher = KeywordMatcher(keywords, config["whole_word"])
+    _config = config
+
+
+def process_unit(unit):
+    """Filters one unit; duplicates inside the unit are dropped here, across units by the parent."""
+    text_field, keep_fields = _config["text_field"], _config["keep_fields"]
+    start, hits, seen = time.perf_counter(), [], set()
+    row_index = 0
+    for batch in iter_batches(unit, [text_field] + keep_fields, _config["batch_rows"]):
+        for row in batch:
+            row_index += 1
+            text = row.get(text_field)
+            if not isinstance(text, str):
+                continue
+            found = _matcher.find(text.lower())
+            if not found:
+                continue
+            digest = text_hash(text)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            # `row` counts from the start of the unit, which `unit` locates within the shard
+            record = {"hash": digest, "text": text, "keywords": sorted(found), "shard": os.path.basename(unit[0]),
+                      "unit": unit_label(unit), "row": row_index - 1}
+            record.update({f: row.get(f) for f in keep_fields})
+            hits.append(record)
+    return unit, row_index, hits, time.perf_counter() - start
+
+
+# --- CHECKPOINT & OUTPUT ---
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        state.setdefault("parts", len({p for p in state["done"].values() if p}))
+        return state
+    return {"done": {}, "rows": 0, "kept": 0, "parts": 0}
+
+
+def save_checkpoint(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def load_seen_hashes(output_dir, state):
+    """Rebuilds the global dedup set from the parts already written."""
+    import pyarrow.parquet as pq
+    seen = set()
+    for part in set(state["done"].values()):
+        if part:
+            seen.update(pq.read_table(os.path.join(output_dir, part), columns=["hash"]).column("hash").to_pylist())
+    return seen
+
+
+def write_part(output_dir, index, records):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    name = f"part-{index:05d}.parquet"
+    tmp = os.path.join(output_dir, f".{name}.tmp")
+    pq.write_table(pa.Table.from_pylist(records), tmp, compression="zstd")
+    os.replace(tmp, os.path.join(output_dir, name))
+    return name
+
+
+def find_shards(inputs, exclude_dir=None):
+    """
+    Expands inputs into shard paths. Skips `_`/`.`-prefixed files (checkpoints, temp
+    parts, Spark/Hadoop markers) and anything under exclude_dir, so an output
+    directory nested in the input is never read back as data.
+    """
+    exclude_dir = os.path.join(os.path.abspath(exclude_dir), "") if exclude_dir else None
+    shards = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for pattern in SHARD_PATTERNS:
+                shards.extend(glob.glob(os.path.join(item, "**", pattern), recursive=True))
+        else:
+            shards.extend(glob.glob(item))
+    shards = {os.path.abspath(s) for s in shards}
+    return sorted(s for s in shards
+                  if not os.path.basename(s).startswith(("_", "."))
+                  and not (exclude_dir and s.startswith(exclude_dir)))
+
+
+def load_keywords(path):
+    if not path:
+        return INDIAN_KEYWORDS
+    with open(path, encoding="utf-8") as f:
+        keywords = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not keywords:
+        raise ValueError(f"No keywords in {path}")
+    return keywords
+
+
+# --- PIPELINE ---
+def run(inputs, output_dir, keywords, text_field="input", keep_fields=(), workers=None, batch_rows=BATCH_ROWS,
+        whole_word=False, unit_mb=UNIT_MB, flush_batches=FLUSH_BATCHES):
+    # Built here so bad keywords fail in the parent; a worker failing in its initializer would be respawned forever
+    matcher = KeywordMatcher(keywords, whole_word)
+    os.makedirs(output_dir, exist_ok=True)
+    # Leading underscore keeps Parquet readers from treating it as a data file
+    checkpoint = os.path.join(output_dir, "_checkpoint.json")
+    state = load_checkpoint(checkpoint)
+    seen = load_seen_hashes(output_dir, state)
+
+    shards = find_shards(inputs, exclude_dir=output_dir)
+    # Byte ranges must line up with the checkpoint's keys, so a resumed run keeps the original unit size
+    unit_bytes = state.setdefault("unit_bytes", int(unit_mb * 1024 * 1024))
+    if unit_bytes != int(unit_mb * 1024 * 1024):
+        print(f"Resuming with the checkpoint's unit size of {unit_bytes / 1024 / 1024:g} MB.")
+    sizes = {}
+    for shard in shards:
+        if shard not in state["done"]:
+            sizes.update(plan_units(shard, unit_bytes))
+    units = [u for u in sizes if unit_key(u) not in state["done"]]
+    if not units:
+        print(f"Nothing to do: {len(state['done'])} units already processed.")
+        return state
+
+    workers = workers or os.cpu_count() or 1
+    config = {"text_field": text_field, "keep_fields": list(keep_fields), "batch_rows": batch_rows, "whole_word": whole_word}
+    matcher_kind = ("aho-corasick" if ahocorasick else "per-keyword scan") + (", whole words" if whole_word else ", substrings")
+    print(f"Curating {len(units)} units from {len(shards)} shards with {workers} workers, {len(matcher.keywords)} keywords ({matcher_kind})...")
+
+    # Finished units wait here until the next flush writes their part
+    pending = {"units": [], "records": [], "rows": 0}
+
+    def flush():
+        if not pending["units"]:
+            return
+        part = None
+        if pending["records"]:
+            part = write_part(output_dir, state["parts"], pending["records"])
+            state["parts"] += 1
+        for key in pending["units"]:
+            state["done"][key] = part
+        state["rows"] += pending["rows"]
+        state["kept"] += len(pending["records"])
+        # Only after the part is on disk, so a crash never marks unwritten rows as done
+        save_checkpoint(checkpoint, state)
+        elapsed = time.perf_counter() - start
+        print(f"  {part or 'no part'}: {len(pending['units'])} units, {pending['rows']:,} rows, {len(pending['records']):,} kept "
+              f"({state['rows'] - rows_before:,} rows this run, {(state['rows'] - rows_before) / max(elapsed, 1e-9):,.0f} rows/s)")
+        pending.update(units=[], records=[], rows=0)
+
+    start, rows_before = time.perf_counter(), state["rows"]
+    with Pool(workers, initializer=_init_worker, initargs=(matcher.keywords, config)) as pool:
+        # Largest units first so the slowest one doesn't start last
+        units.sort(key=sizes.get, reverse=True)
+        for unit, rows, hits, secs in pool.imap_unordered(process_unit, units):
+            fresh = [h for h in hits if h["hash"] not in seen]
+            seen.update(h["hash"] for h in fresh)
+            pending["units"].append(unit_key(unit))
+            pending["records"].extend(fresh)
+            pending["rows"] += rows
+            if pending["rows"] >= flush_batches * batch_rows:
+                flush()
+        flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {state['rows']:,} rows scanned, {state['kept']:,} unique matches, {elapsed:.1f}s this run.")
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter and deduplicate local dataset shards by keyword")
+    parser.add_argument("inputs", nargs="+", help="Shard files, globs or directories (JSONL, JSONL.GZ, Parquet)")
+    parser.add_argument("--output", required=True, help="Directory for Parquet parts and _checkpoint.json")
+    parser.add_argument("--keywords", help="File with one keyword per line (default: built-in Everyday India list)")
+    parser.add_argument("--text-field", default="input", help="Column holding the user query")
+    parser.add_argument("--keep", default="", help="Comma-separated extra columns to copy, e.g. output")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--unit-mb", type=float, default=UNIT_MB, help="Byte range per JSONL work unit")
+    parser.add_argument("--flush-batches", type=int, default=FLUSH_BATCHES, help="Batches' worth of rows per written part")
+    parser.add_argument("--whole-word", action="store_true", help="Only match keywords as whole words ('auto' won't match 'automatic')")
+    args = parser.parse_args()
+
+    keep_fields = [f for f in args.keep.split(",") if f]
+    try:
+        keywords = load_keywords(args.keywords)
+    except ValueError as e:
+        parser.error(str(e))
+    run(args.inputs, args.output, keywords, args.text_field, keep_fields, args.workers, args.batch_rows,
+        args.whole_word, args.unit_mb, args.flush_batches)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
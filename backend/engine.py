@@ -1,18 +1,24 @@
-import os, base64, uuid, scipy.io.wavfile as wavfile, noisereduce as nr
-import pandas as pd
-import PyPDF2
-import docx
-import zipfile
-import py7zr  # For .7z support
-import pyttsx3 # For Zira/David Voice
+import os, re, time, base64, uuid, contextvars
+from concurrent.futures import ThreadPoolExecutor
 from groq import Groq
 from dotenv import load_dotenv
-from gtts import gTTS
-from PIL import Image, ImageEnhance
+from extractors import get_extractor, get_unpacker, media, EXTRACTORS, UNPACKERS
+from budget import allocate_context, get_limits, get_prompt_budget, message_tokens
+from admission import scheduler, QueueFull
+from metrics import timed, observe, note_timing, record_error, RATE_BUCKETS
 
 load_dotenv()
 client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
+# Fallback order per request type
+VISION_MODELS = ["llama-3.2-90b-vision-preview", "llama-3.2-11b-vision-preview"]
+TEXT_MODELS = ["llama-3.3-70b-versatile", "llama-3.1-70b-versatile"]
+FAST_TEXT_MODELS = ["llama-3.1-8b-instant"]
+
+# Shared, bounded pool for document extraction across all requests
+EXTRACT_WORKERS = int(os.getenv("SYNAPSE_EXTRACT_WORKERS", "4"))
+extract_pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="synapse-extract")
+
 PERSONAS = {
     "Default": "Standard preset style and tone.",
     "Professional": "Polished and precise.",
@@ -27,114 +33,212 @@ PERSONAS = {
 # --- HELPER: READ CONTENT FROM ANY FILE TYPE ---
 def get_file_text(file_path):
     ext = os.path.splitext(file_path)[1].lower()
+    # Archive members pick their own extensions, so only known types become metric labels
+    file_type = (ext or "none") if ext in EXTRACTORS or ext in UNPACKERS else "other"
+    with timed("doc_extract", file_type=file_type):
+        return _read_file_text(file_path, ext)
+
+def _read_file_text(file_path, ext):
+    # Handlers import their heavy libraries (PyPDF2, docx, pandas) on first use
+    extractor = get_extractor(ext)
+    if extractor is None:
+        return ""
     try:
-        text_extensions = {'.txt', '.py', '.java', '.js', '.jsx', '.ts', '.tsx', '.html', '.css', '.json', '.cpp', '.c', '.php', '.rb', '.go', '.sh', '.md'}
-        if ext in text_extensions or ext == "":
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f"\n--- File: {os.path.basename(file_path)} ---\n{f.read()}\n"
-        elif ext == ".pdf":
-            text = ""
-            with open(file_path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text += page.extract_text() or ""
-            return f"\n--- PDF: {os.path.basename(file_path)} ---\n{text}\n"
-        elif ext == ".docx":
-            doc = docx.Document(file_path)
-            text = "\n".join([p.text for p in doc.paragraphs])
-            return f"\n--- Word: {os.path.basename(file_path)} ---\n{text}\n"
-        elif ext == ".csv":
-            df = pd.read_csv(file_path)
-            return f"\n--- CSV Data: {os.path.basename(file_path)} ---\n{df.head(20).to_string()}\n"
-        elif ext == ".xlsx":
-            df = pd.read_excel(file_path)
-            return f"\n--- Excel Data: {os.path.basename(file_path)} ---\n{df.head(20).to_string()}\n"
+        return extractor(file_path)
     except Exception as e:
+        record_error("doc_extract", e)
         return f"\n[Error reading {os.path.basename(file_path)}: {str(e)}]\n"
-    return ""
 
-# --- MAIN STREAMING FUNCTION ---
-def get_synapse_streaming(user_text, lang_code, chat_history, image_path=None, doc_path=None, fast_mode=False, persona="Default", location="Unknown"):
-    # 1. AUTO-FALLBACK LIST: If one model is down, it tries the next one
-    vision_models = ["llama-3.2-90b-vision-preview", "llama-3.2-11b-vision-preview"]
-    text_models = ["llama-3.1-8b-instant"] if fast_mode else ["llama-3.3-70b-versatile", "llama-3.1-70b-versatile"]
-    
-    models_to_try = vision_models if image_path else text_models
-    
-    # 2. MAP/LOCATION & PERSONA LOGIC (RESTORED)
-    tone_description = PERSONAS.get(persona, PERSONAS["Default"])
-    loc_context = f"The user is in {location}, India. " if location != "Unknown" else ""
-
-    # 3. DOCUMENT PROCESSING (RESTORED)
+# --- HELPER: DOCUMENT OR ARCHIVE TO PROMPT CONTEXT ---
+def get_document_context(doc_path):
     doc_context = ""
-    if doc_path and os.path.exists(doc_path):
-        ext = os.path.splitext(doc_path)[1].lower()
-        if ext in [".zip", ".7z"]:
-            extract_dir = os.path.join(os.path.dirname(doc_path), f"ext_{uuid.uuid4().hex[:6]}")
-            os.makedirs(extract_dir, exist_ok=True)
-            try:
-                if ext == ".zip":
-                    with zipfile.ZipFile(doc_path, 'r') as zip_ref:
-                        zip_ref.extractall(extract_dir)
-                else:
-                    with py7zr.SevenZipFile(doc_path, mode='r') as z:
-                        z.extractall(path=extract_dir)
-                
-                doc_context += f"\n[ARCHIVE CONTENTS - {os.path.basename(doc_path)}]:\n"
-                for root, dirs, files in os.walk(extract_dir):
-                    for file in files:
-                        full_p = os.path.join(root, file)
-                        doc_context += get_file_text(full_p)
-            except Exception as e:
-                doc_context = f"\n[Archive Extraction Error: {str(e)}]\n"
-        else:
-            doc_context = get_file_text(doc_path)
-
-    system_prompt = (
-        f"You are Synapse-V, an AI for Everyday India. {loc_context}"
-        f"Respond in {'Hindi' if lang_code == 'hi' else 'English'}. "
-        f"TONE: {tone_description} "
-        "CONTEXT: You understand code files, archives, and Indian nuances. "
-        "Analyze any code or document provided. If you see code, explain it or debug it if asked. "
-        "Never say 'As an AI model'."
+    if not doc_path or not os.path.exists(doc_path):
+        return doc_context
+    ext = os.path.splitext(doc_path)[1].lower()
+    unpack = get_unpacker(ext)
+    if unpack:
+        extract_dir = os.path.join(os.path.dirname(doc_path), f"ext_{uuid.uuid4().hex[:6]}")
+        os.makedirs(extract_dir, exist_ok=True)
+        try:
+            with timed("archive_unpack", file_type=ext):
+                unpack(doc_path, extract_dir)
+            
+            doc_context += f"\n[ARCHIVE CONTENTS - {os.path.basename(doc_path)}]:\n"
+            for root, dirs, files in os.walk(extract_dir):
+                for file in files:
+                    full_p = os.path.join(root, file)
+                    doc_context += get_file_text(full_p)
+        except Exception as e:
+            doc_context = f"\n[Archive Extraction Error: {str(e)}]\n"
+    else:
+        doc_context = get_file_text(doc_path)
+    return doc_context
+
+# --- HELPER: MANY DOCUMENTS, MOST RELEVANT FIRST ---
+def _relevance(text, query_terms):
+    """Distinct query terms found in the text, then how densely they occur."""
+    lowered = text.lower()
+    hits = [lowered.count(term) for term in query_terms]
+    found = sum(1 for h in hits if h)
+    return found, sum(hits) / max(len(lowered), 1)
+
+def gather_documents(doc_paths, user_text):
+    """Extracts every document on the shared pool and returns their blocks, most relevant first."""
+    # Each task runs in its own copy of the request context, so stage timings reach this request's log
+    futures = [extract_pool.submit(contextvars.copy_context().run, get_document_context, p) for p in doc_paths]
+    blocks = []
+    for path, future in zip(doc_paths, futures):
+        try:
+            blocks.append(future.result())
+        except Exception as e:
+            record_error("doc_extract", e)
+            blocks.append(f"\n[Error reading {os.path.basename(path)}: {str(e)}]\n")
+
+    query_terms = {w for w in re.findall(r"\w+", user_text.lower()) if len(w) > 2}
+    if len(blocks) > 1 and query_terms:
+        # Stable sort keeps upload order between equally relevant files
+        blocks.sort(key=lambda b: _relevance(b, query_terms), reverse=True)
+    return blocks
+
+# --- HELPER: MODELS AND TOKEN RESERVATION FOR ADMISSION ---
+def reservation(model_id):
+    """Tokens to reserve on admission: the model's whole prompt budget plus its reply."""
+    return get_prompt_budget([model_id]) + get_limits(model_id)["output"]
+
+def plan_request(fast_mode=False, has_images=False):
+    """
+    Fallback models for a request, in order, mapped to the tokens to reserve on each.
+    The prompt isn't built until a model is admitted, so each reserves its full
+    budget; get_synapse_streaming hands back what the real prompt didn't use.
+    """
+    if has_images:
+        models = VISION_MODELS
+    else:
+        models = FAST_TEXT_MODELS if fast_mode else TEXT_MODELS
+    return {model_id: reservation(model_id) for model_id in models}
+
+# --- HELPER: PROMPT FOR ONE MODEL ---
+def _image_urls(image_paths):
+    urls = []
+    for image_path in image_paths:
+        with open(image_path, "rb") as f:
+            b64 = base64.b64encode(f.read()).decode('utf-8')
+        urls.append(f"data:image/jpeg;base64,{b64}")
+    return urls
+
+def build_messages(model_id, system_prompt, chat_history, doc_blocks, user_text, image_urls):
+    """Fits history and documents into model_id's prompt budget and assembles the chat messages."""
+    chat_history, doc_context = allocate_context(
+        [model_id], system_prompt, chat_history, doc_blocks, user_text, image_count=len(image_urls)
     )
-    
+
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend(chat_history)
-    
-    if len(doc_context) > 20000:
-        doc_context = doc_context[:20000] + "\n... [Content Truncated] ..."
 
     full_user_query = f"{doc_context}\nUSER REQUEST: {user_text}"
-    
-    if image_path:
-        with open(image_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode('utf-8')
-        content = [
-            {"type": "text", "text": full_user_query},
-            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}}
-        ]
+
+    if image_urls:
+        content = [{"type": "text", "text": full_user_query}]
+        content.extend({"type": "image_url", "image_url": {"url": url}} for url in image_urls)
         messages.append({"role": "user", "content": content})
     else:
         messages.append({"role": "user", "content": full_user_query})
+    return messages
+
+# --- MAIN STREAMING FUNCTION ---
+def get_synapse_streaming(user_text, lang_code, chat_history, image_paths=None, doc_paths=None, fast_mode=False, persona="Default", location="Unknown", admission=None):
+    """`admission` is (model_id, reserved_tokens) when the caller already waited for admission."""
+    image_paths = image_paths or []
+    doc_paths = doc_paths or []
+    # 1. AUTO-FALLBACK LIST: If one model is down, it tries the next one
+    reservations = plan_request(fast_mode, bool(image_paths))
+    models_to_try = list(reservations)
     
-    # 4. AUTO-RETRY LOOP
+    # 2. MAP/LOCATION & PERSONA LOGIC (RESTORED)
+    tone_description = PERSONAS.get(persona, PERSONAS["Default"])
+    loc_context = f"The user is in {location}, India. " if location != "Unknown" else ""
+
+    # 3. DOCUMENT PROCESSING: all files extract concurrently, so latency tracks the slowest one
+    doc_blocks = gather_documents(doc_paths, user_text)
+
+    # 4. ADMISSION: the HTTP layer waits before streaming; direct callers wait here
+    if admission is None:
+        try:
+            ticket = scheduler.enqueue(fast_mode, reservations)
+        except QueueFull as e:
+            yield f"Synapse-V is busy right now ({e.depth} requests waiting). Please try again in {e.retry_after} seconds."
+            return
+        model_id = scheduler.acquire(ticket)
+        if model_id is None:
+            yield "Synapse-V is busy right now because of rate limits. Please try again in a few seconds."
+            return
+        admission = model_id, reservations[model_id]
+    admitted, reserved = admission
+
+    with timed("prompt_build"):
+        system_prompt = (
+            f"You are Synapse-V, an AI for Everyday India. {loc_context}"
+            f"Respond in {'Hindi' if lang_code == 'hi' else 'English'}. "
+            f"TONE: {tone_description} "
+            "CONTEXT: You understand code files, archives, and Indian nuances. "
+            "Analyze any code or document provided. If you see code, explain it or debug it if asked. "
+            "Never say 'As an AI model'."
+        )
+        image_urls = _image_urls(image_paths)
+        # Sized for the admitted model; a fallback with a smaller budget gets the prompt re-fitted
+        messages = build_messages(admitted, system_prompt, chat_history, doc_blocks, user_text, image_urls)
+
+    # The prompt was built inside the reserved budget; hand back the rest right away
+    prompt_tokens = sum(message_tokens(m) for m in messages)
+    est_tokens = min(prompt_tokens + get_limits(admitted)["output"], reserved)
+    scheduler.release(admitted, reserved - est_tokens)
+
+    # 5. AUTO-RETRY LOOP: admitted model first, then fallbacks that still have headroom
     completion = None
-    for model_id in models_to_try:
+    for model_id in [admitted] + [m for m in models_to_try if m != admitted]:
+        if model_id != admitted:
+            if get_prompt_budget([model_id]) < prompt_tokens:
+                messages = build_messages(model_id, system_prompt, chat_history, doc_blocks, user_text, image_urls)
+                prompt_tokens = sum(message_tokens(m) for m in messages)
+            est_tokens = prompt_tokens + get_limits(model_id)["output"]
+            if not scheduler.try_take(model_id, est_tokens):
+                continue
+        request_start = time.perf_counter()
         try:
-            completion = client.chat.completions.create(model=model_id, messages=messages, stream=True)
+            raw = client.chat.completions.with_raw_response.create(
+                model=model_id, messages=messages, stream=True, max_tokens=get_limits(model_id)["output"]
+            )
+            scheduler.update_from_headers(model_id, raw.headers)
+            completion = raw.parse()
             break # Success!
         except Exception as e:
-            print(f"Model {model_id} failed. Trying next... Error: {e}")
+            # Rate-limit errors carry the same x-ratelimit-* headers as successful responses
+            scheduler.update_from_headers(model_id, getattr(getattr(e, "response", None), "headers", None))
+            scheduler.release(model_id, est_tokens)
+            record_error("model_request", e)
+            print(f"Model {model_id} failed. Trying next...")
             continue
 
     if not completion:
         yield "Error: All models are currently unavailable on Groq. Please try again later."
         return
 
+    # Groq streams roughly one token per chunk, so chunk count stands in for output tokens
+    first_token_at, chunks = None, 0
     for chunk in completion:
         if chunk.choices[0].delta.content:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                observe("synapse_ttft_seconds", first_token_at - request_start, "Time to first token per model.", model=model_id)
+                note_timing("first_token", first_token_at - request_start)
+            chunks += 1
             yield chunk.choices[0].delta.content
+    scheduler.release(model_id, get_limits(model_id)["output"] - chunks)
+
+    if first_token_at is not None:
+        gen_time = time.perf_counter() - first_token_at
+        if gen_time > 0:
+            observe("synapse_tokens_per_second", chunks / gen_time, "Streaming output rate per model.", RATE_BUCKETS, model=model_id)
 
 # --- VOICE UTILITIES (RESTORED) ---
 def text_to_speech(text, upload_dir, lang='en', voice="Zira"):
@@ -143,46 +247,54 @@ def text_to_speech(text, upload_dir, lang='en', voice="Zira"):
     
     if voice in ["Zira", "David"]:
         try:
-            engine = pyttsx3.init()
-            voices = engine.getProperty('voices')
-            target_voice = None
-            for v in voices:
-                if voice.lower() in v.name.lower():
-                    target_voice = v.id
-                    break
-            if not target_voice:
-                if voice == "David" and len(voices) > 0: target_voice = voices[0].id
-                elif voice == "Zira" and len(voices) > 1: target_voice = voices[1].id
-
-            if target_voice:
-                engine.setProperty('voice', target_voice)
+            with timed("tts", engine="pyttsx3"):
+                pyttsx3, = media("tts_local")
+                engine = pyttsx3.init()
+                voices = engine.getProperty('voices')
+                target_voice = None
+                for v in voices:
+                    if voice.lower() in v.name.lower():
+                        target_voice = v.id
+                        break
+                if not target_voice:
+                    if voice == "David" and len(voices) > 0: target_voice = voices[0].id
+                    elif voice == "Zira" and len(voices) > 1: target_voice = voices[1].id
+
+                if target_voice:
+                    engine.setProperty('voice', target_voice)
             
-            engine.setProperty('rate', 180)
-            engine.save_to_file(text[:500], full_path)
-            engine.runAndWait()
-            engine.stop() 
-            return fn
+                engine.setProperty('rate', 180)
+                engine.save_to_file(text[:500], full_path)
+                engine.runAndWait()
+                engine.stop() 
+                return fn
         except Exception as e:
             print(f"Local TTS Error: {e}")
     
     try:
-        tts = gTTS(text=text[:500], lang=lang)
-        tts.save(full_path)
+        with timed("tts", engine="gtts"):
+            gtts, = media("tts_cloud")
+            tts = gtts.gTTS(text=text[:500], lang=lang)
+            tts.save(full_path)
         return fn
-    except:
+    except Exception as e:
+        print(f"gTTS Error: {e}")
         return None
 
 # --- IMAGE/AUDIO UTILITIES (RESTORED) ---
 def reduce_audio_noise(file_path):
     try:
-        rate, data = wavfile.read(file_path)
-        reduced_noise = nr.reduce_noise(y=data, sr=rate, prop_decrease=0.8)
-        wavfile.write(file_path, rate, reduced_noise)
-    except: pass
+        with timed("denoise"):
+            wavfile, nr = media("denoise")
+            rate, data = wavfile.read(file_path)
+            reduced_noise = nr.reduce_noise(y=data, sr=rate, prop_decrease=0.8)
+            wavfile.write(file_path, rate, reduced_noise)
+    except Exception as e:
+        print(f"Denoise Error: {e}")
 
 def transcribe_audio(file_path, lang='en'):
     try:
-        with open(file_path, "rb") as file:
+        with timed("transcription"), open(file_path, "rb") as file:
             transcription = client.audio.transcriptions.create(
                 file=(file_path, file.read()),
                 model="whisper-large-v3-turbo",
@@ -190,14 +302,18 @@ def transcribe_audio(file_path, lang='en'):
                 response_format="text"
             )
         return transcription.strip()
-    except: return "Transcription error."
+    except Exception as e:
+        print(f"Transcription Error: {e}")
+        return "Transcription error."
 
 def enhance_low_light(p):
-    with Image.open(p) as i:
+    Image, ImageEnhance = media("image")
+    with timed("image_enhance"), Image.open(p) as i:
         i = ImageEnhance.Brightness(i).enhance(1.5)
         i.save(p)
 
 def compress_image(p):
-    with Image.open(p) as i:
+    Image, _ = media("image")
+    with timed("image_compress"), Image.open(p) as i:
         i.thumbnail((1024, 1024))
         i.save(p, quality=40)
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import zipfile
+import threading
+import importlib
+
+from metrics import observe
+
+# --- LAZY IMPORTS ---
+# Heavy libraries are imported on first use so the API can answer /list_files
+# and text-only chat before pandas/scipy/PIL/etc. have finished loading.
+IMPORT_TIMES = {}
+
+
+def lazy_import(name):
+    """Imports a module once, recording how long the first import took."""
+    if name in sys.modules:
+        # import_module waits on the import lock if another thread is still loading it
+        return importlib.import_module(name)
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - start
+    IMPORT_TIMES.setdefault(name, elapsed)
+    observe("synapse_import_seconds", elapsed, "First-import time of lazily loaded libraries.", module=name)
+    return module
+
+
+# Modules each media operation needs, also used to order the background prewarm
+MEDIA_MODULES = {
+    "image": ["PIL.Image", "PIL.ImageEnhance"],
+    "tts_cloud": ["gtts"],
+    "tts_local": ["pyttsx3"],
+    "denoise": ["scipy.io.wavfile", "noisereduce"],
+}
+
+
+def media(operation):
+    """Returns the loaded modules for a media operation, in MEDIA_MODULES order."""
+    return [lazy_import(name) for name in MEDIA_MODULES[operation]]
+
+
+# --- DOCUMENT EXTRACTORS ---
+EXTRACTORS = {}   # extension -> (handler, modules it needs)
+UNPACKERS = {}    # archive extension -> (handler, modules it needs)
+
+TEXT_EXTENSIONS = {'.txt', '.py', '.java', '.js', '.jsx', '.ts', '.tsx', '.html', '.css', '.json', '.cpp', '.c', '.php', '.rb', '.go', '.sh', '.md', ''}
+
+
+def register(*extensions, modules=()):
+    def decorator(handler):
+        for ext in extensions:
+            EXTRACTORS[ext] = (handler, list(modules))
+        return handler
+    return decorator
+
+
+def register_archive(*extensions, modules=()):
+    def decorator(handler):
+        for ext in extensions:
+            UNPACKERS[ext] = (handler, list(modules))
+        return handler
+    return decorator
+
+
+def get_extractor(ext):
+    entry = EXTRACTORS.get(ext)
+    return entry[0] if entry else None
+
+
+def get_unpacker(ext):
+    entry = UNPACKERS.get(ext)
+    return entry[0] if entry else None
+
+
+@register(*TEXT_EXTENSIONS)
+def read_text(file_path):
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        return f"\n--- File: {os.path.basename(file_path)} ---\n{f.read()}\n"
+
+
+@register(".pdf", modules=["PyPDF2"])
+def read_pdf(file_path):
+    PyPDF2 = lazy_import("PyPDF2")
+    text = ""
+    with open(file_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        for page in reader.pages:
+            text += page.extract_text() or ""
+    return f"\n--- PDF: {os.path.basename(file_path)} ---\n{text}\n"
+
+
+@register(".docx", modules=["docx"])
+def read_docx(file_path):
+    docx = lazy_import("docx")
+    doc = docx.Document(file_path)
+    text = "\n".join([p.text for p in doc.paragraphs])
+    return f"\n--- Word: {os.path.basename(file_path)} ---\n{text}\n"
+
+
+@register(".csv", modules=["pandas"])
+def read_csv(file_path):
+    from tabular import read_csv_table
+    preview, profile = read_csv_table(file_path)
+    return _table_text("CSV Data", file_path, preview, profile)
+
+
+@register(".xlsx", modules=["pandas", "openpyxl"])
+def read_xlsx(file_path):
+    from tabular import read_xlsx_table
+    preview, profile = read_xlsx_table(file_path)
+    return _table_text("Excel Data", file_path, preview, profile)
+
+
+def _table_text(label, file_path, preview, profile):
+    text = f"\n--- {label}: {os.path.basename(file_path)} ---\n{preview}\n"
+    if profile:
+        text += f"{profile}\n"
+    return text
+
+
+@register_archive(".zip")
+def unpack_zip(archive_path, extract_dir):
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        zip_ref.extractall(extract_dir)
+
+
+@register_archive(".7z", modules=["py7zr"])
+def unpack_7z(archive_path, extract_dir):
+    py7zr = lazy_import("py7zr")
+    with py7zr.SevenZipFile(archive_path, mode='r') as z:
+        z.extractall(path=extract_dir)
+
+
+# --- PREWARM & REPORT ---
+def prewarm_modules():
+    """Every heavy module the registry knows about, most commonly needed first."""
+    ordered = []
+    for entries in (EXTRACTORS.values(), UNPACKERS.values()):
+        for _, modules in entries:
+            ordered.extend(m for m in modules if m not in ordered)
+    for modules in MEDIA_MODULES.values():
+        ordered.extend(m for m in modules if m not in ordered)
+    return ordered
+
+
+def prewarm(modules=None):
+    """Imports heavy modules on a daemon thread so the first upload doesn't pay for them."""
+    def run():
+        for name in modules or prewarm_modules():
+            try:
+                lazy_import(name)
+            except Exception as e:
+                print(f"Prewarm skipped {name}: {e}")
+        print(f"Prewarm finished: {len(IMPORT_TIMES)} modules in {sum(IMPORT_TIMES.values()):.2f}s")
+
+    thread = threading.Thread(target=run, name="synapse-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def import_report():
+    loaded = {name: round(secs * 1000, 1) for name, secs in sorted(IMPORT_TIMES.items(), key=lambda kv: -kv[1])}
+    pending = [name for name in prewarm_modules() if name not in sys.modules]
+    return {"import_ms": loaded, "total_ms": round(sum(loaded.values()), 1), "not_loaded": pending}
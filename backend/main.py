@@ -4,9 +4,9 @@ import uuid
 import json
 import uvicorn
 import time
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import FileResponse, StreamingResponse
-from typing import Optional
+from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, JSONResponse
+from typing import List, Optional
 from contextlib import asynccontextmanager
 
 # Importing your custom logic modules
@@ -16,7 +16,9 @@ from engine import (
     transcribe_audio, 
     reduce_audio_noise, 
     compress_image, 
-    enhance_low_light
+    enhance_low_light,
+    plan_request,
+    VISION_MODELS
 )
 from database import (
     create_db_and_tables, 
@@ -26,20 +28,86 @@ from database import (
     delete_all_history, 
     delete_specific_interaction
 )
+from metrics import (
+    timed,
+    observe,
+    render_prometheus,
+    start_request_timings,
+    server_timing_header,
+    TIMING_HEADER
+)
+from extractors import prewarm, import_report, get_extractor, get_unpacker
+from admission import scheduler, QueueFull
+from budget import max_images
 
 # --- LIFESPAN HANDLER ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initializes database on launch."""
+    """Initializes database on launch and warms heavy imports in the background."""
     create_db_and_tables()
+    if os.getenv("SYNAPSE_PREWARM", "1") == "1":
+        prewarm()
     yield
 
 app = FastAPI(title="Synapse-V Backend", lifespan=lifespan)
 
+# --- REQUEST TIMING ---
+STREAMED_PATHS = {"/stream_process"}
+
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    """
+    Records request latency per route and optionally exposes stage timings as Server-Timing.
+    The header only covers work done before headers are sent; for streamed replies the stages
+    that run inside the stream (doc_extract, prompt_build, first_token) are logged when it ends.
+    """
+    timings = start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - start
+    route = request.scope.get("route")
+    path = route.path if route else "unmatched"
+    observe(
+        "synapse_request_seconds", total, "Time to response headers per endpoint.",
+        path=path, method=request.method
+    )
+    if TIMING_HEADER:
+        response.headers["Server-Timing"] = server_timing_header(timings, total)
+        if path in STREAMED_PATHS:
+            response.body_iterator = _log_stream_timings(response.body_iterator, path, timings, start)
+    return response
+
+async def _log_stream_timings(body, path, timings, start):
+    async for chunk in body:
+        yield chunk
+    print(f"[timing] {path} {server_timing_header(timings, time.perf_counter() - start)}")
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/queue")
+async def queue_status():
+    """Admission queue depth per lane and remaining rate-limit budget per model."""
+    return scheduler.status()
+
+@app.get("/import_report")
+async def get_import_report():
+    """Which heavy libraries are loaded yet and how long each took to import."""
+    return import_report()
+
 # Ensure upload directory exists
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Upload limits for /stream_process, checked before anything is written or extracted
+MAX_UPLOAD_FILES = int(os.getenv("SYNAPSE_MAX_UPLOAD_FILES", "10"))
+MAX_IMAGES = max_images(VISION_MODELS)  # Whatever fits in the vision models' prompt budget
+MAX_DOC_MB = float(os.getenv("SYNAPSE_MAX_DOC_MB", "25"))
+MAX_IMAGE_MB = float(os.getenv("SYNAPSE_MAX_IMAGE_MB", "10"))
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp'}
+
 # --- CATEGORIZED FILE EXPLORER ---
 @app.get("/list_files")
 async def list_files():
@@ -51,7 +119,7 @@ async def list_files():
     
     # Extension mappings
     ext_map = {
-        'images': {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp'},
+        'images': IMAGE_EXTENSIONS,
         'audio': {'.wav', '.mp3', '.m4a', '.flac', '.ogg'},
         'documents': {'.pdf', '.docx', '.csv', '.xlsx', '.txt', '.py', '.zip', '.7z', '.java', '.js'}
     }
@@ -85,6 +153,38 @@ async def delete_file(filename: str):
     return {"status": "error", "message": "File not found"}
 
 # --- STREAM PROCESS ---
+def _upload_size(upload: UploadFile):
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    return size
+
+def _validate_uploads(images, documents):
+    """Rejects the whole request up front if any file is unsupported or too large."""
+    if len(images) + len(documents) > MAX_UPLOAD_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files (max {MAX_UPLOAD_FILES}).")
+    if len(images) > MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"Too many images (max {MAX_IMAGES}).")
+    for upload in images:
+        ext = os.path.splitext(upload.filename or "")[1].lower()
+        if ext and ext not in IMAGE_EXTENSIONS:
+            raise HTTPException(status_code=415, detail=f"Unsupported image type: {upload.filename}")
+        if _upload_size(upload) > MAX_IMAGE_MB * 1024 * 1024:
+            raise HTTPException(status_code=413, detail=f"{upload.filename} is larger than {MAX_IMAGE_MB:g} MB.")
+    for upload in documents:
+        ext = os.path.splitext(upload.filename or "")[1].lower()
+        if get_extractor(ext) is None and get_unpacker(ext) is None:
+            raise HTTPException(status_code=415, detail=f"Unsupported document type: {upload.filename}")
+        if _upload_size(upload) > MAX_DOC_MB * 1024 * 1024:
+            raise HTTPException(status_code=413, detail=f"{upload.filename} is larger than {MAX_DOC_MB:g} MB.")
+
+def _busy_response(depth, retry_after):
+    return JSONResponse(
+        status_code=429,
+        content={"error": "Server busy", "queue_depth": depth, "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
 @app.post("/stream_process")
 async def stream_process(
     text: str = Form(...), 
@@ -95,37 +195,62 @@ async def stream_process(
     location: str = Form("Unknown"),
     image: Optional[UploadFile] = File(None),
     document: Optional[UploadFile] = File(None),
+    images: Optional[List[UploadFile]] = File(None),
+    documents: Optional[List[UploadFile]] = File(None),
     low_light: bool = Form(False)
 ):
-    img_path = None
-    doc_path = None
+    # Single `image`/`document` fields still work alongside the multi-file ones
+    images = ([image] if image else []) + (images or [])
+    documents = ([document] if document else []) + (documents or [])
+    _validate_uploads(images, documents)
+
+    # Backpressure: tell the client to come back later rather than queueing a request that would time out
+    reservations = plan_request(fast, bool(images))
+    if not scheduler.fits(reservations):
+        raise HTTPException(status_code=413, detail="Request is larger than the models' per-minute token quota.")
+    try:
+        ticket = scheduler.enqueue(fast, reservations)
+    except QueueFull as e:
+        return _busy_response(e.depth, e.retry_after)
+
+    # Wait for rate-limit headroom on the event loop, before any response is started
+    model_id = await scheduler.acquire_async(ticket)
+    if model_id is None:
+        status = scheduler.status()
+        return _busy_response(status["fast_waiting"] + status["normal_waiting"], status["retry_after"])
 
-    if image:
+    img_paths = []
+    for upload in images:
         # Robust naming for uploaded vs captured images
-        orig_ext = os.path.splitext(image.filename)[1] if image.filename else ".jpg"
-        img_path = os.path.join(UPLOAD_DIR, f"img_{uuid.uuid4().hex}{orig_ext}")
-        with open(img_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+        orig_ext = os.path.splitext(upload.filename)[1] if upload.filename else ".jpg"
+        img_path = os.path.join(UPLOAD_DIR, f"img_{uuid.uuid4().hex}{orig_ext or '.jpg'}")
+        with timed("upload_write", kind="image"), open(img_path, "wb") as buffer:
+            shutil.copyfileobj(upload.file, buffer)
         compress_image(img_path)
         if low_light: enhance_low_light(img_path)
+        img_paths.append(img_path)
 
-    if document:
-        doc_path = os.path.join(UPLOAD_DIR, f"doc_{uuid.uuid4().hex}_{document.filename}")
-        with open(doc_path, "wb") as buffer:
-            shutil.copyfileobj(document.file, buffer)
+    doc_paths = []
+    for upload in documents:
+        doc_path = os.path.join(UPLOAD_DIR, f"doc_{uuid.uuid4().hex}_{os.path.basename(upload.filename)}")
+        with timed("upload_write", kind="document"), open(doc_path, "wb") as buffer:
+            shutil.copyfileobj(upload.file, buffer)
+        doc_paths.append(doc_path)
 
     return StreamingResponse(
         get_synapse_streaming(
             user_text=text, 
             lang_code=lang, 
             chat_history=json.loads(history), 
-            image_path=img_path, 
-            doc_path=doc_path, 
+            image_paths=img_paths, 
+            doc_paths=doc_paths, 
             fast_mode=fast, 
             persona=persona,
-            location=location 
+            location=location,
+            admission=(model_id, reservations[model_id])
         ), 
-        media_type="text/plain"
+        media_type="text/plain",
+        headers={"X-Queue-Position": str(ticket.position), "X-Queue-Wait": f"{time.monotonic() - ticket.enqueued_at:.2f}"}
     )
 
 @app.post("/process_voice")
@@ -135,7 +260,7 @@ async def process_voice(
     noise: bool = Form(False)
 ):
     path = os.path.join(UPLOAD_DIR, f"v_{uuid.uuid4().hex}.wav")
-    with open(path, "wb") as buffer:
+    with timed("upload_write", kind="audio"), open(path, "wb") as buffer:
         shutil.copyfileobj(audio.file, buffer)
     if noise:
         reduce_audio_noise(path)
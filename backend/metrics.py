@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# --- CONFIG ---
+# Adds a Server-Timing header with per-stage durations to every response. Headers go out
+# before a streamed body is generated, so streams also log a timing line when they finish.
+TIMING_HEADER = os.getenv("SYNAPSE_TIMING_HEADER", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+_lock = threading.Lock()
+_histograms = {}   # name -> {"help", "buckets", "series": {labels: [bucket_counts, sum, count]}}
+_counters = {}     # name -> {"help", "series": {labels: value}}
+
+# Per-request stage timings, filled while a request is being served
+_request_timings = ContextVar("request_timings", default=None)
+
+
+# --- RECORDING ---
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, value, help_text="", buckets=LATENCY_BUCKETS, **labels):
+    with _lock:
+        hist = _histograms.setdefault(name, {"help": help_text, "buckets": buckets, "series": {}})
+        series = hist["series"].setdefault(_key(labels), [[0] * len(hist["buckets"]), 0.0, 0])
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+
+def inc(name, amount=1, help_text="", **labels):
+    with _lock:
+        counter = _counters.setdefault(name, {"help": help_text, "series": {}})
+        key = _key(labels)
+        counter["series"][key] = counter["series"].get(key, 0) + amount
+
+
+def record_error(stage, error=None):
+    inc("synapse_errors_total", help_text="Errors by pipeline stage.", stage=stage)
+    if error is not None:
+        print(f"[{stage}] {type(error).__name__}: {error}")
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Times a pipeline stage into synapse_stage_seconds and counts it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_error(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("synapse_stage_seconds", elapsed, "Duration of each pipeline stage.", stage=stage, **labels)
+        note_timing(stage, elapsed)
+
+
+# --- PER-REQUEST TIMING ---
+def note_timing(stage, secs):
+    """
+    Adds to the current request's stage timings, if a request is being timed.
+    Parallel extraction threads share the dict, so their stage times add up.
+    """
+    timings = _request_timings.get()
+    if timings is not None:
+        with _lock:
+            timings[stage] = timings.get(stage, 0.0) + secs
+
+
+def start_request_timings():
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings, total):
+    parts = [f"{stage};dur={secs * 1000:.1f}" for stage, secs in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- PROMETHEUS EXPOSITION ---
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        for name, hist in sorted(_histograms.items()):
+            lines.append(f"# HELP {name} {hist['help']}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (counts, total, count) in sorted(hist["series"].items()):
+                for bound, c in zip(hist["buckets"], counts):
+                    lines.append(f"{name}_bucket{_fmt_labels(key, [('le', bound)])} {c}")
+                lines.append(f"{name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {total}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {count}")
+        for name, counter in sorted(_counters.items()):
+            lines.append(f"# HELP {name} {counter['help']}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(counter["series"].items()):
+                lines.append(f"{name}{_fmt_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,6 @@
 import pandas as pd
 from datasets import load_dataset
+from curation import INDIAN_KEYWORDS, KeywordMatcher
 
 # We use "Abhishekcr448/Hinglish-Everyday-Conversations-1M" 
 # It is specifically made for Indian day-to-day life topics.
@@ -10,8 +11,8 @@ print(f"Streaming dataset: {dataset_name}...")
 # 1. Load the dataset in streaming mode (Safe for your RAM)
 ds = load_dataset(dataset_name, split="train", streaming=True)
 
-# 2. Define keywords that define "Everyday India"
-indian_keywords = ["biryani", "metro", "upi", "diwali", "recharge", "aadhaar", "auto", "train", "office", "recipe"]
+# 2. Keywords that define "Everyday India" (for full offline runs over local shards, see curation.py)
+matcher = KeywordMatcher(INDIAN_KEYWORDS)
 
 filtered_queries = []
 
@@ -21,7 +22,7 @@ for i, entry in enumerate(ds):
     # The dataset uses 'input' for the user query
     query = entry['input'].lower() 
     
-    if any(word in query for word in indian_keywords):
+    if matcher.find(query):
         # Save the actual Hinglish text
         filtered_queries.append(entry['input'])
         
@@ -0,0 +1,138 @@
+import os
+
+from extractors import lazy_import
+
+# --- CONFIG ---
+PREVIEW_ROWS = 20
+CHUNK_ROWS = int(os.getenv("SYNAPSE_TABLE_CHUNK_ROWS", "50000"))
+# Profile the whole file in one chunked pass (set to 0 to only send the preview)
+PROFILE_TABLES = os.getenv("SYNAPSE_TABLE_PROFILE", "1") == "1"
+TOP_VALUES = 3
+TOP_TRACKED = 1000  # Distinct values kept per column while counting; beyond this counts are approximate
+
+
+# --- COLUMN PROFILE ---
+class TableProfile:
+    """Accumulates per-column stats chunk by chunk, so memory is bounded by the chunk size."""
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+
+    def _column(self, name):
+        return self.columns.setdefault(name, {
+            "dtypes": set(), "nulls": 0, "count": 0, "sum": 0.0,
+            "min": None, "max": None, "values": None, "approx": False,
+            "numeric_chunks": 0, "other_chunks": 0,
+        })
+
+    def update(self, df):
+        self.rows += len(df)
+        nulls = df.isna().sum()
+        counts = df.count()
+        numeric = df.select_dtypes(include="number")
+        if len(numeric.columns):
+            mins, maxs, sums = numeric.min(), numeric.max(), numeric.sum()
+
+        for name in df.columns:
+            col = self._column(name)
+            col["nulls"] += int(nulls[name])
+            # pandas reads an all-empty chunk as float64, which says nothing about the column's type
+            if not counts[name]:
+                continue
+            col["dtypes"].add(str(df[name].dtype))
+            if name in numeric.columns:
+                col["numeric_chunks"] += 1
+                col["min"] = mins[name] if col["min"] is None else min(col["min"], mins[name])
+                col["max"] = maxs[name] if col["max"] is None else max(col["max"], maxs[name])
+                col["sum"] += float(sums[name])
+                col["count"] += int(counts[name])
+                continue
+
+            col["other_chunks"] += 1
+            counts_here = df[name].value_counts()
+            col["values"] = counts_here if col["values"] is None else col["values"].add(counts_here, fill_value=0)
+            if len(col["values"]) > TOP_TRACKED:
+                col["values"] = col["values"].nlargest(TOP_TRACKED // 2)
+                col["approx"] = True
+
+    def summary(self):
+        lines = [f"[Profile: {self.rows:,} rows x {len(self.columns)} columns]"]
+        for name, col in self.columns.items():
+            dtype = "/".join(sorted(col["dtypes"])) or "empty"
+            parts = [f"nulls={col['nulls']:,}"]
+            if col["numeric_chunks"] and col["other_chunks"]:
+                # Numbers in some chunks, text in others: stats from either part would misdescribe the column
+                lines.append(f"{name} (mixed {dtype}): " + ", ".join(parts) + ", mixed numeric/text values, stats skipped")
+                continue
+            if col["count"]:
+                parts.append(f"min={_fmt(col['min'])}, max={_fmt(col['max'])}, mean={_fmt(col['sum'] / col['count'])}")
+            if col["values"] is not None and len(col["values"]):
+                non_null = max(self.rows - col["nulls"], 1)
+                top = col["values"].nlargest(TOP_VALUES)
+                prefix = "~" if col["approx"] else ""
+                if col["approx"] and top.iloc[0] <= 1:
+                    parts.append("mostly unique values")
+                else:
+                    parts.append("top=" + ", ".join(f"{v} ({prefix}{c / non_null:.0%})" for v, c in top.items()))
+            lines.append(f"{name} ({dtype}): " + ", ".join(parts))
+        return "\n".join(lines)
+
+
+def _fmt(value):
+    try:
+        return f"{float(value):.6g}"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# --- READERS ---
+def read_csv_table(file_path, profile=PROFILE_TABLES):
+    """Preview rows plus an optional whole-file profile, reading at most CHUNK_ROWS rows at a time."""
+    pd = lazy_import("pandas")
+    if not profile:
+        return pd.read_csv(file_path, nrows=PREVIEW_ROWS).to_string(), None
+
+    stats, preview = TableProfile(), None
+    for chunk in pd.read_csv(file_path, chunksize=CHUNK_ROWS, low_memory=True):
+        if preview is None:
+            preview = chunk.head(PREVIEW_ROWS).copy()
+        stats.update(chunk)
+    preview = preview if preview is not None else pd.DataFrame()
+    return preview.to_string(), stats.summary()
+
+
+def read_xlsx_table(file_path, profile=PROFILE_TABLES):
+    """Streams the first sheet through openpyxl's read-only mode instead of loading the workbook."""
+    pd = lazy_import("pandas")
+    openpyxl = lazy_import("openpyxl")
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame().to_string(), None
+        header = [str(h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+
+        stats, preview, buffer = TableProfile(), None, []
+        for row in rows:
+            buffer.append(row)
+            if not profile and len(buffer) >= PREVIEW_ROWS:
+                break
+            if len(buffer) >= CHUNK_ROWS:
+                chunk = pd.DataFrame.from_records(buffer, columns=header).infer_objects()
+                preview = chunk.head(PREVIEW_ROWS).copy() if preview is None else preview
+                stats.update(chunk)
+                buffer = []
+        if buffer or preview is None:
+            chunk = pd.DataFrame.from_records(buffer, columns=header).infer_objects()
+            preview = chunk.head(PREVIEW_ROWS).copy() if preview is None else preview
+            if profile:
+                stats.update(chunk)
+
+        summary = stats.summary() if profile else None
+        if summary and len(wb.sheetnames) > 1:
+            summary += f"\n[Workbook has {len(wb.sheetnames)} sheets; profiled '{ws.title}' only]"
+        return preview.to_string(), summary
+    finally:
+        wb.close()
@@ -190,9 +190,22 @@ def run_streaming_chat(user_text, lang, fast, noise, image_file, doc_file, low_l
         data = {"text": user_text, "lang": lang, "history": json.dumps(hist), "fast": str(fast).lower(), "low_light": str(low_light).lower(), "persona": persona, "location": location}
         try:
             with requests.post(f"{BASE_URL}/stream_process", data=data, files=files if files else None, stream=True) as r:
+                # Busy (429) or rejected uploads (413/415) are not answers: show them, don't save or speak them
+                if r.status_code != 200:
+                    body = r.json() if "json" in r.headers.get("content-type", "") else {}
+                    if r.status_code == 429:
+                        resp_container.warning(f"Synapse-V is busy ({body.get('queue_depth', 0)} requests waiting). "
+                                               f"Please try again in {r.headers.get('Retry-After', body.get('retry_after', 'a few'))} seconds.")
+                    else:
+                        resp_container.error(body.get("detail") or f"Request failed ({r.status_code}).")
+                    st.session_state.chat_thread.pop()
+                    return
                 for chunk in r.iter_content(None, decode_unicode=True):
                     full_txt += chunk
                     resp_container.markdown(full_txt + "▌")
+                queued_for = float(r.headers.get("X-Queue-Wait", 0))
+                if queued_for >= 1:
+                    st.caption(f"Waited {queued_for:.0f}s in queue behind {r.headers.get('X-Queue-Position', 0)} requests.")
             resp_container.markdown(full_txt)
             st.session_state.chat_thread.append({"role": "assistant", "content": full_txt})
             st.session_state.chat_history[st.session_state.current_session_id] = st.session_state.chat_thread